@@ -4,13 +4,19 @@ AnyRouter.top 自动签到脚本
 """
 
 import asyncio
-import hashlib
-import json
+import functools
 import os
+import re
 import sys
+import time
+from collections.abc import Iterator
 from datetime import datetime
+from itertools import chain
 
+import aiohttp
 import httpx
+import orjson
+import xxhash
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright
 
@@ -19,6 +25,31 @@ from notify import notify
 load_dotenv()
 
 BALANCE_HASH_FILE = 'balance_hash.txt'
+WAF_CACHE_FILE = '.waf_cache.json'
+WAF_CACHE_TTL = 20 * 60
+WAF_COOKIE_NAMES = ['acw_tc', 'cdn_sec_tc', 'acw_sc__v2']
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36'
+
+# 阿里云 WAF 挑战页中 acw_sc__v2 的计算参数
+_ACW_ARG1_RE = re.compile(r"var\s+arg1\s*=\s*'([0-9A-Fa-f]+)'")
+_ACW_POS_LIST = [
+    15, 35, 29, 24, 33, 16, 1, 38, 10, 9, 19, 31, 40, 27, 22, 23, 25, 13, 6, 11,
+    39, 18, 20, 8, 14, 21, 32, 26, 2, 30, 7, 4, 17, 5, 3, 28, 34, 37, 12, 36,
+]
+_ACW_MASK = '3000176000856006061501533003690027800375'
+
+
+class WafChallengeError(Exception):
+    """WAF cookies 失效，签到请求被 WAF 拦截"""
+
+
+class _AccountLog:
+    """缓存单个账号的日志输出，并发执行时避免多个账号的日志交错"""
+
+    def __init__(self, name):
+        self.name = name
+        self.buf = []
 
 
 def format_balance_display(quota: float, used: float) -> str:
@@ -30,46 +61,50 @@ def format_balance_display(quota: float, used: float) -> str:
         )
 
 
-def format_balance_markdown(account_name: str, quota: float, used: float) -> list[str]:
-        """以 Markdown 方式格式化余额信息"""
-        return [
-                f'- **{account_name}**',
-                f'  - 剩余额度：`${quota}`',
-                f'  - 已使用：`${used}`',
-        ]
+def format_balance_markdown(account_name: str, quota: float, used: float) -> Iterator[str]:
+        """以 Markdown 方式格式化余额信息，逐行生成"""
+        yield f'- **{account_name}**'
+        yield f'  - 剩余额度：`${quota}`'
+        yield f'  - 已使用：`${used}`'
+
+
+@functools.lru_cache(maxsize=1)
+def _parse_accounts(accounts_str):
+    """解析并校验多账号配置，格式错误时抛出 ValueError，只有解析成功的结果会被缓存"""
+    try:
+        accounts_data = orjson.loads(accounts_str)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f'Account configuration format is incorrect: {e}') from e
+
+    # 检查是否为数组格式
+    if not isinstance(accounts_data, list):
+        raise ValueError('Account configuration must use array format [{}]')
+
+    # 验证账号数据格式
+    for i, account in enumerate(accounts_data):
+        if not isinstance(account, dict):
+            raise ValueError(f'Account {i + 1} configuration format is incorrect')
+        if 'cookies' not in account or 'api_user' not in account:
+            raise ValueError(f'Account {i + 1} missing required fields (cookies, api_user)')
+        # 如果有 name 字段，确保它不是空字符串
+        if 'name' in account and not account['name']:
+            raise ValueError(f'Account {i + 1} name field cannot be empty')
+
+    return tuple(accounts_data)
 
 
 def load_accounts():
-    """从环境变量加载多账号配置"""
+    """从环境变量加载多账号配置，相同配置只解析一次"""
     accounts_str = os.getenv('ANYROUTER_ACCOUNTS')
     if not accounts_str:
         print('ERROR: ANYROUTER_ACCOUNTS environment variable not found')
         return None
 
     try:
-        accounts_data = json.loads(accounts_str)
-
-        # 检查是否为数组格式
-        if not isinstance(accounts_data, list):
-            print('ERROR: Account configuration must use array format [{}]')
-            return None
-
-        # 验证账号数据格式
-        for i, account in enumerate(accounts_data):
-            if not isinstance(account, dict):
-                print(f'ERROR: Account {i + 1} configuration format is incorrect')
-                return None
-            if 'cookies' not in account or 'api_user' not in account:
-                print(f'ERROR: Account {i + 1} missing required fields (cookies, api_user)')
-                return None
-            # 如果有 name 字段，确保它不是空字符串
-            if 'name' in account and not account['name']:
-                print(f'ERROR: Account {i + 1} name field cannot be empty')
-                return None
-
-        return accounts_data
-    except Exception as e:
-        print(f'ERROR: Account configuration format is incorrect: {e}')
+        # 每次返回新的列表和账号字典，避免调用方修改缓存内容
+        return [dict(account) for account in _parse_accounts(accounts_str)]
+    except ValueError as e:
+        print(f'ERROR: {e}')
         return None
 
 
@@ -87,18 +122,52 @@ def load_balance_hash():
 def save_balance_hash(balance_hash):
     """保存余额hash"""
     try:
-        with open(BALANCE_HASH_FILE, 'w', encoding='utf-8') as f:
+        # 先写入临时文件再原子替换，避免写入中断导致文件损坏
+        tmp_file = f'{BALANCE_HASH_FILE}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             f.write(balance_hash)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, BALANCE_HASH_FILE)
     except Exception as e:
         print(f'Warning: Failed to save balance hash: {e}')
 
 
 def generate_balance_hash(balances):
     """生成余额数据的hash"""
-    # 将包含 quota 和 used 的结构转换为简单的 quota 值用于 hash 计算
-    simple_balances = {k: v['quota'] for k, v in balances.items()} if balances else {}
-    balance_json = json.dumps(simple_balances, sort_keys=True, separators=(',', ':'))
-    return hashlib.sha256(balance_json.encode('utf-8')).hexdigest()[:16]
+    # 只对各账号的 quota 值计算 hash，按账号键排序后逐项写入，避免构造中间 JSON 字符串
+    hasher = xxhash.xxh3_64()
+    for key in sorted(balances or {}):
+        hasher.update(key.encode('utf-8'))
+        hasher.update(b'=')
+        hasher.update(repr(balances[key]['quota']).encode('utf-8'))
+        hasher.update(b';')
+    return hasher.hexdigest()
+
+
+def load_waf_cookies_cache():
+    """加载未过期的 WAF cookies 缓存"""
+    try:
+        if os.path.exists(WAF_CACHE_FILE):
+            with open(WAF_CACHE_FILE, 'rb') as f:
+                cache = orjson.loads(f.read())
+            if cache.get('expires_at', 0) > time.time():
+                return cache.get('cookies')
+    except Exception:
+        pass
+    return None
+
+
+def save_waf_cookies_cache(waf_cookies, expires, log):
+    """保存 WAF cookies 缓存，有效期取 cookie 过期时间与 WAF_CACHE_TTL 中较早者"""
+    try:
+        expires_at = time.time() + WAF_CACHE_TTL
+        if expires:
+            expires_at = min(expires_at, expires)
+        with open(WAF_CACHE_FILE, 'wb') as f:
+            f.write(orjson.dumps({'cookies': waf_cookies, 'expires_at': expires_at}))
+    except Exception as e:
+        log.buf.append(f'Warning: {log.name}: Failed to save WAF cookies cache: {e}')
 
 
 def get_account_display_name(account_info, account_index):
@@ -114,189 +183,299 @@ def parse_cookies(cookies_data):
     if isinstance(cookies_data, str):
         cookies_dict = {}
         for cookie in cookies_data.split(';'):
-            if '=' in cookie:
-                key, value = cookie.strip().split('=', 1)
+            key, sep, value = cookie.strip().partition('=')
+            if sep:
                 cookies_dict[key] = value
         return cookies_dict
     return {}
 
 
-async def get_waf_cookies_with_playwright(account_name: str):
-    """使用 Playwright 获取 WAF cookies（隐私模式）"""
-    print(f'[PROCESSING] {account_name}: Starting browser to get WAF cookies...')
-
-    async with async_playwright() as p:
-        import tempfile
-        with tempfile.TemporaryDirectory() as temp_dir:
-            context = await p.chromium.launch_persistent_context(
-                user_data_dir=temp_dir,
-                headless=False,
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
-                viewport={'width': 1920, 'height': 1080},
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-dev-shm-usage',
-                    '--disable-web-security',
-                    '--disable-features=VizDisplayCompositor',
-                    '--no-sandbox',
-                ],
-                )
-
-            page = await context.new_page()
+def calc_acw_sc_v2(arg1):
+    """根据 WAF 挑战页中的 arg1 计算 acw_sc__v2"""
+    output = [''] * len(_ACW_POS_LIST)
+    for i, char in enumerate(arg1):
+        for j, pos in enumerate(_ACW_POS_LIST):
+            if pos == i + 1:
+                output[j] = char
+    arg2 = ''.join(output)
 
-            try:
-                print(f'[PROCESSING] {account_name}: Step 1: Access login page to get initial cookies...')
+    result = []
+    for i in range(0, min(len(arg2), len(_ACW_MASK)), 2):
+        value = int(arg2[i : i + 2], 16) ^ int(_ACW_MASK[i : i + 2], 16)
+        result.append(f'{value:02x}')
+    return ''.join(result)
 
-                await page.goto('https://anyrouter.top/login', wait_until='networkidle')
 
-                try:
-                    await page.wait_for_function('document.readyState === "complete"', timeout=5000)
-                except Exception:
-                    await page.wait_for_timeout(3000)
+async def _try_fetch_waf_cookies_http(log):
+    """不启动浏览器，直接通过 HTTP 请求获取 WAF cookies，返回 (cookies, 最早过期时间)"""
+    headers = {
+        'User-Agent': USER_AGENT,
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    }
+
+    try:
+        async with httpx.AsyncClient(http2=True, follow_redirects=True, timeout=30.0, headers=headers) as client:
+            response = await client.get('https://anyrouter.top/login')
+
+            # 命中 acw_sc__v2 挑战时，计算后带上 cookie 重新请求
+            match = _ACW_ARG1_RE.search(response.text)
+            if match:
+                client.cookies.set('acw_sc__v2', calc_acw_sc_v2(match.group(1)), domain='anyrouter.top')
+                response = await client.get('https://anyrouter.top/login')
+                if _ACW_ARG1_RE.search(response.text):
+                    return None, None
+
+            waf_cookies = {}
+            expires = []
+            for cookie in client.cookies.jar:
+                if cookie.name in WAF_COOKIE_NAMES and cookie.value is not None:
+                    waf_cookies[cookie.name] = cookie.value
+                    if cookie.expires:
+                        expires.append(cookie.expires)
+
+        # 未触发挑战（或挑战已通过）时，WAF 只要下发了 acw_tc 即可正常访问
+        if 'acw_tc' not in waf_cookies:
+            log.buf.append(f'[INFO] {log.name}: HTTP request did not receive acw_tc cookie')
+            return None, None
+
+        log.buf.append(f'[SUCCESS] {log.name}: Got WAF cookies without browser: {sorted(waf_cookies)}')
+        return waf_cookies, min(expires, default=None)
+    except Exception as e:
+        log.buf.append(f'[INFO] {log.name}: Failed to get WAF cookies via HTTP: {e}')
+        return None, None
 
-                cookies = await page.context.cookies()
 
-                waf_cookies = {}
-                for cookie in cookies:
-                    cookie_name = cookie.get('name')
-                    cookie_value = cookie.get('value')
-                    if cookie_name in ['acw_tc', 'cdn_sec_tc', 'acw_sc__v2'] and cookie_value is not None:
-                        waf_cookies[cookie_name] = cookie_value
+async def launch_browser(p):
+    """启动供所有账号共享的浏览器实例"""
+    return await p.chromium.launch(
+        headless=True,
+        args=[
+            '--disable-blink-features=AutomationControlled',
+            '--disable-dev-shm-usage',
+            '--disable-web-security',
+            '--disable-features=VizDisplayCompositor',
+            '--no-sandbox',
+        ],
+    )
 
-                print(f'[INFO] {account_name}: Got {len(waf_cookies)} WAF cookies after step 1')
 
-                required_cookies = ['acw_tc', 'cdn_sec_tc', 'acw_sc__v2']
-                missing_cookies = [c for c in required_cookies if c not in waf_cookies]
+async def get_waf_cookies_with_playwright(browser, log):
+    """使用 Playwright 获取 WAF cookies（独立的浏览器上下文，相当于隐私模式），返回 (cookies, 最早过期时间)"""
+    log.buf.append(f'[PROCESSING] {log.name}: Opening browser context to get WAF cookies...')
 
-                if missing_cookies:
-                    print(f'[FAILED] {account_name}: Missing WAF cookies: {missing_cookies}')
-                    await context.close()
-                    return None
+    context = await browser.new_context(
+        user_agent=USER_AGENT,
+        viewport={'width': 1920, 'height': 1080},
+    )
 
-                print(f'[SUCCESS] {account_name}: Successfully got all WAF cookies')
+    try:
+        page = await context.new_page()
 
-                await context.close()
+        log.buf.append(f'[PROCESSING] {log.name}: Step 1: Access login page to get initial cookies...')
 
-                return waf_cookies
+        await page.goto('https://anyrouter.top/login', wait_until='networkidle')
 
-            except Exception as e:
-                print(f'[FAILED] {account_name}: Error occurred while getting WAF cookies: {e}')
-                await context.close()
-                return None
+        try:
+            await page.wait_for_function('document.readyState === "complete"', timeout=5000)
+        except Exception:
+            await page.wait_for_timeout(3000)
+
+        cookies = await context.cookies()
+
+        waf_cookies = {}
+        expires = []
+        for cookie in cookies:
+            cookie_name = cookie.get('name')
+            cookie_value = cookie.get('value')
+            if cookie_name in WAF_COOKIE_NAMES and cookie_value is not None:
+                waf_cookies[cookie_name] = cookie_value
+                # 会话 cookie 的 expires 为 -1
+                if cookie.get('expires', -1) > 0:
+                    expires.append(cookie['expires'])
+
+        log.buf.append(f'[INFO] {log.name}: Got {len(waf_cookies)} WAF cookies after step 1')
+
+        missing_cookies = [c for c in WAF_COOKIE_NAMES if c not in waf_cookies]
+
+        if missing_cookies:
+            log.buf.append(f'[FAILED] {log.name}: Missing WAF cookies: {missing_cookies}')
+            return None, None
+
+        log.buf.append(f'[SUCCESS] {log.name}: Successfully got all WAF cookies')
+
+        return waf_cookies, min(expires, default=None)
+
+    except Exception as e:
+        log.buf.append(f'[FAILED] {log.name}: Error occurred while getting WAF cookies: {e}')
+        return None, None
+    finally:
+        await context.close()
+
+
+async def get_waf_cookies(get_browser, log, use_cache=True):
+    """获取 WAF cookies：优先使用缓存，其次直接 HTTP 请求，最后回退到浏览器
+
+    WAF cookies 与来源 IP 绑定而非账号，同一次运行中所有账号共用一份。
+    """
+    if use_cache:
+        waf_cookies = load_waf_cookies_cache()
+        if waf_cookies:
+            log.buf.append(f'[INFO] {log.name}: Using cached WAF cookies')
+            return waf_cookies
+
+    waf_cookies, expires = await _try_fetch_waf_cookies_http(log)
+    if not waf_cookies:
+        browser = await get_browser()
+        waf_cookies, expires = await get_waf_cookies_with_playwright(browser, log)
 
+    if waf_cookies:
+        save_waf_cookies_cache(waf_cookies, expires, log)
+    return waf_cookies
 
-def get_user_info(client, headers):
+
+async def get_user_info(session, headers, cookies):
     """获取用户信息"""
     try:
-        response = client.get('https://anyrouter.top/api/user/self', headers=headers, timeout=30)
-
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('success'):
-                user_data = data.get('data', {})
-                quota = round(user_data.get('quota', 0) / 500000, 2)
-                used_quota = round(user_data.get('used_quota', 0) / 500000, 2)
-                return {
-                    'success': True,
-                    'quota': quota,
-                    'used_quota': used_quota,
-                    'display': format_balance_display(quota, used_quota)
-                }
-        return {'success': False, 'error': f'Failed to get user info: HTTP {response.status_code}'}
+        async with session.get('https://anyrouter.top/api/user/self', headers=headers, cookies=cookies) as response:
+            if response.status == 200:
+                data = orjson.loads(await response.read())
+                if data.get('success'):
+                    user_data = data.get('data', {})
+                    quota = round(user_data.get('quota', 0) / 500000, 2)
+                    used_quota = round(user_data.get('used_quota', 0) / 500000, 2)
+                    return {
+                        'success': True,
+                        'quota': quota,
+                        'used_quota': used_quota,
+                        'display': format_balance_display(quota, used_quota)
+                    }
+            return {'success': False, 'error': f'Failed to get user info: HTTP {response.status}'}
     except Exception as e:
         return {'success': False, 'error': f'Failed to get user info: {str(e)[:50]}...'}
 
 
-async def check_in_account(account_info, account_index):
+def is_waf_rejection(status, body):
+    """判断响应是否为 WAF 拦截：返回了新的挑战页，或是非 JSON 的 403 页面"""
+    if _ACW_ARG1_RE.search(body):
+        return True
+    if status != 403:
+        return False
+    # 业务接口自身返回的 403（如账号被禁用）是 JSON，不视为 WAF 拦截
+    try:
+        orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return True
+    return False
+
+
+async def sign_in(session, headers, cookies):
+    """执行签到请求，返回状态码和响应内容"""
+    async with session.post(
+        'https://anyrouter.top/api/user/sign_in', headers=headers, cookies=cookies, json={}
+    ) as response:
+        return response.status, await response.text()
+
+
+async def check_in_account(session, waf_cookies, account_info, log):
     """为单个账号执行签到操作"""
-    account_name = get_account_display_name(account_info, account_index)
-    print(f'\n[PROCESSING] Starting to process {account_name}')
+    log.buf.append(f'\n[PROCESSING] Starting to process {log.name}')
 
     # 解析账号配置
     cookies_data = account_info.get('cookies', {})
     api_user = account_info.get('api_user', '')
 
     if not api_user:
-        print(f'[FAILED] {account_name}: API user identifier not found')
+        log.buf.append(f'[FAILED] {log.name}: API user identifier not found')
         return False, None
 
     # 解析用户 cookies
     user_cookies = parse_cookies(cookies_data)
     if not user_cookies:
-        print(f'[FAILED] {account_name}: Invalid configuration format')
+        log.buf.append(f'[FAILED] {log.name}: Invalid configuration format')
         return False, None
 
-    # 步骤1：获取 WAF cookies
-    waf_cookies = await get_waf_cookies_with_playwright(account_name)
+    # 步骤1：检查共享的 WAF cookies
     if not waf_cookies:
-        print(f'[FAILED] {account_name}: Unable to get WAF cookies')
+        log.buf.append(f'[FAILED] {log.name}: Unable to get WAF cookies')
         return False, None
 
-    # 步骤2：使用 httpx 进行 API 请求
-    client = httpx.Client(http2=True, timeout=30.0)
-
+    # 步骤2：使用共享的 aiohttp 会话进行 API 请求，cookies 按请求传入以隔离各账号
     try:
         # 合并 WAF cookies 和用户 cookies
         all_cookies = {**waf_cookies, **user_cookies}
-        client.cookies.update(all_cookies)
 
         headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
+            'User-Agent': USER_AGENT,
             'Accept': 'application/json, text/plain, */*',
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, br, zstd',
+            'Accept-Encoding': 'gzip, deflate',
             'Referer': 'https://anyrouter.top/console',
             'Origin': 'https://anyrouter.top',
             'Connection': 'keep-alive',
             'Sec-Fetch-Dest': 'empty',
             'Sec-Fetch-Mode': 'cors',
             'Sec-Fetch-Site': 'same-origin',
-            'new-api-user': api_user,
+            'new-api-user': str(api_user),
         }
 
-        user_info = get_user_info(client, headers)
-        if user_info and user_info.get('success'):
-            print(user_info['display'])
-        elif user_info:
-            print(user_info.get('error', 'Unknown error'))
-
-        print(f'[NETWORK] {account_name}: Executing check-in')
-
         # 更新签到请求头
         checkin_headers = headers.copy()
         checkin_headers.update({'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'})
 
-        response = client.post('https://anyrouter.top/api/user/sign_in', headers=checkin_headers, timeout=30)
+        # 签到请求不依赖用户信息，两个请求并发执行，完成后再按原顺序输出日志
+        user_info, checkin_result = await asyncio.gather(
+            get_user_info(session, headers, all_cookies),
+            sign_in(session, checkin_headers, all_cookies),
+            return_exceptions=True,
+        )
 
-        print(f'[RESPONSE] {account_name}: Response status code {response.status_code}')
+        if isinstance(user_info, BaseException):
+            user_info = {'success': False, 'error': f'Failed to get user info: {str(user_info)[:50]}...'}
+        if user_info.get('success'):
+            log.buf.append(user_info['display'])
+        else:
+            log.buf.append(user_info.get('error', 'Unknown error'))
+
+        log.buf.append(f'[NETWORK] {log.name}: Executing check-in')
+
+        if isinstance(checkin_result, BaseException):
+            log.buf.append(f'[FAILED] {log.name}: Error occurred during check-in process - {str(checkin_result)[:50]}...')
+            return False, user_info
+        status, body = checkin_result
+
+        log.buf.append(f'[RESPONSE] {log.name}: Response status code {status}')
+
+        if is_waf_rejection(status, body):
+            raise WafChallengeError(f'WAF rejected request with HTTP {status}')
 
-        if response.status_code == 200:
+        if status == 200:
             try:
-                result = response.json()
+                result = orjson.loads(body)
                 if result.get('ret') == 1 or result.get('code') == 0 or result.get('success'):
-                    print(f'[SUCCESS] {account_name}: Check-in successful!')
+                    log.buf.append(f'[SUCCESS] {log.name}: Check-in successful!')
                     return True, user_info
                 else:
                     error_msg = result.get('msg', result.get('message', 'Unknown error'))
-                    print(f'[FAILED] {account_name}: Check-in failed - {error_msg}')
+                    log.buf.append(f'[FAILED] {log.name}: Check-in failed - {error_msg}')
                     return False, user_info
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 # 如果不是 JSON 响应，检查是否包含成功标识
-                if 'success' in response.text.lower():
-                    print(f'[SUCCESS] {account_name}: Check-in successful!')
+                if 'success' in body.lower():
+                    log.buf.append(f'[SUCCESS] {log.name}: Check-in successful!')
                     return True, user_info
                 else:
-                    print(f'[FAILED] {account_name}: Check-in failed - Invalid response format')
+                    log.buf.append(f'[FAILED] {log.name}: Check-in failed - Invalid response format')
                     return False, user_info
         else:
-            print(f'[FAILED] {account_name}: Check-in failed - HTTP {response.status_code}')
+            log.buf.append(f'[FAILED] {log.name}: Check-in failed - HTTP {status}')
             return False, user_info
 
+    except WafChallengeError:
+        raise
     except Exception as e:
-        print(f'[FAILED] {account_name}: Error occurred during check-in process - {str(e)[:50]}...')
+        log.buf.append(f'[FAILED] {log.name}: Error occurred during check-in process - {str(e)[:50]}...')
         return False, None
-    finally:
-        client.close()
 
 
 async def main():
@@ -324,47 +503,133 @@ async def main():
     balance_changed = False  # 余额是否有变化
     balances_for_notification = []
 
-    for i, account in enumerate(accounts):
-        account_key = f'account_{i + 1}'
-        account_name = get_account_display_name(account, i)
-        try:
-            success, user_info = await check_in_account(account, i)
-            if success:
-                success_count += 1
-
-            detail_message = ''
-
-            # 收集余额数据
-            if user_info and user_info.get('success'):
-                current_quota = user_info['quota']
-                current_used = user_info['used_quota']
-                current_balances[account_key] = {
-                    'quota': current_quota,
-                    'used': current_used,
-                }
-                detail_message = f'剩余额度：`${current_quota}` · 已使用：`${current_used}`'
-            elif user_info:
-                detail_message = user_info.get('error', 'Unknown error')
+    # 并发执行各账号签到，使用信号量限制同时运行的账号数量
+    sem = asyncio.Semaphore(max(1, int(os.getenv('ANYROUTER_CONCURRENCY', '4'))))
+
+    # WAF cookies 在同一次运行中由所有账号共享，被 WAF 拦截时只重新获取一次
+    waf_state = {'cookies': None, 'refreshed': False}
+    waf_lock = asyncio.Lock()
+
+    async def refresh_waf_cookies(stale_cookies, log):
+        async with waf_lock:
+            if waf_state['cookies'] is stale_cookies and not waf_state['refreshed']:
+                waf_state['refreshed'] = True
+                log.buf.append(f'[INFO] {log.name}: WAF cookies rejected, fetching new ones')
+                new_waf_cookies = await get_waf_cookies(get_browser, log, use_cache=False)
+                # 重新获取失败时保留原有 cookies，不影响其他账号
+                if new_waf_cookies:
+                    waf_state['cookies'] = new_waf_cookies
+        return waf_state['cookies']
+
+    async def _run_one(i, account):
+        log = _AccountLog(get_account_display_name(account, i))
+        async with sem:
+            try:
+                waf_cookies = waf_state['cookies']
+                try:
+                    success, user_info = await check_in_account(session, waf_cookies, account, log)
+                except WafChallengeError:
+                    new_waf_cookies = await refresh_waf_cookies(waf_cookies, log)
+                    if not new_waf_cookies or new_waf_cookies is waf_cookies:
+                        raise
+                    success, user_info = await check_in_account(session, new_waf_cookies, account, log)
+                return i, log.name, success, user_info, None, log.buf
+            except Exception as e:
+                return i, log.name, False, None, e, log.buf
+
+    # 所有账号共享同一个浏览器进程，每个账号使用独立的上下文；仅在需要时才启动浏览器
+    p = None
+    browser = None
+    browser_lock = asyncio.Lock()
+
+    async def get_browser():
+        nonlocal p, browser
+        async with browser_lock:
+            if browser is None:
+                # 启动失败时停止本次启动的驱动，避免下次调用重复启动导致泄漏
+                driver = await async_playwright().start()
+                try:
+                    launched = await launch_browser(driver)
+                except BaseException:
+                    await driver.stop()
+                    raise
+                p, browser = driver, launched
+        return browser
+
+    # 所有账号共享同一个 HTTP 会话以复用连接；不保存响应 cookies，避免账号之间互相影响
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=30),
+        cookie_jar=aiohttp.DummyCookieJar(),
+        timeout=aiohttp.ClientTimeout(total=30),
+    )
 
-            account_results.append({
-                'name': account_name,
-                'success': success,
-                'detail': detail_message,
-            })
+    try:
+        waf_log = _AccountLog('WAF')
+        waf_state['cookies'] = await get_waf_cookies(get_browser, waf_log)
+        sys.stdout.write('\n'.join(waf_log.buf) + '\n')
 
-            # 如果签到失败，需要通知
-            if not success:
-                need_notify = True
-                print(f'[NOTIFY] {account_name} failed, will send notification')
+        results = await asyncio.gather(
+            *[_run_one(i, account) for i, account in enumerate(accounts)], return_exceptions=True
+        )
+    finally:
+        await session.close()
+        if browser:
+            await browser.close()
+        if p:
+            await p.stop()
+
+    # 按账号顺序汇总结果，保证通知内容的顺序稳定
+    outcomes = []
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            result = (i, get_account_display_name(accounts[i], i), False, None, result, [])
+        outcomes.append(result)
+    outcomes.sort(key=lambda r: r[0])
+
+    # 各账号的日志在并发执行期间缓存，结束后按账号顺序一次性输出，避免交错
+    sys.stdout.write('\n'.join(chain.from_iterable(outcome[5] for outcome in outcomes)) + '\n')
+    sys.stdout.flush()
+
+    for i, account_name, success, user_info, exc, _ in outcomes:
+        account_key = f'account_{i + 1}'
 
-        except Exception as e:
-            print(f'[FAILED] {account_name} processing exception: {e}')
+        if exc is not None:
+            print(f'[FAILED] {account_name} processing exception: {exc}')
             need_notify = True  # 异常也需要通知
             account_results.append({
                 'name': account_name,
                 'success': False,
-                'detail': f'异常：{str(e)[:50]}...'
+                'detail': f'异常：{str(exc)[:50]}...'
             })
+            continue
+
+        if success:
+            success_count += 1
+
+        detail_message = ''
+
+        # 收集余额数据
+        if user_info and user_info.get('success'):
+            current_quota = user_info['quota']
+            current_used = user_info['used_quota']
+            current_balances[account_key] = {
+                'quota': current_quota,
+                'used': current_used,
+            }
+            detail_message = f'剩余额度：`${current_quota}` · 已使用：`${current_used}`'
+        elif user_info:
+            detail_message = user_info.get('error', 'Unknown error')
+
+        account_results.append({
+            'name': account_name,
+            'success': success,
+            'detail': detail_message,
+        })
+
+        # 如果签到失败，需要通知
+        if not success:
+            need_notify = True
+            print(f'[NOTIFY] {account_name} failed, will send notification')
 
     # 检查余额变化
     current_balance_hash = generate_balance_hash(current_balances) if current_balances else None
@@ -394,50 +659,45 @@ async def main():
                     'used': current_balances[account_key]['used'],
                 })
 
-    # 保存当前余额hash
-    if current_balance_hash:
+    # 仅在余额hash变化时保存
+    if current_balance_hash and current_balance_hash != last_balance_hash:
         save_balance_hash(current_balance_hash)
 
     if need_notify and (account_results or balances_for_notification):
         # 构建 Markdown 通知内容
         time_info = f'**执行时间：** {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
 
-        sections = [time_info]
+        # 各行按顺序写入同一个列表，最后只做一次拼接
+        parts = [time_info]
 
         if balances_for_notification:
-            balance_lines = ['### 账户余额']
+            parts.append('\n\n### 账户余额')
             for balance in balances_for_notification:
-                balance_lines.extend(
-                    format_balance_markdown(balance['name'], balance['quota'], balance['used'])
-                )
-            sections.append('\n'.join(balance_lines))
+                for line in format_balance_markdown(balance['name'], balance['quota'], balance['used']):
+                    parts.extend(('\n', line))
 
         if account_results:
-            detail_lines = ['### 账号签到详情']
+            parts.append('\n\n### 账号签到详情')
             for result in account_results:
                 status_icon = '✅' if result['success'] else '❌'
-                line = f'- {status_icon} **{result["name"]}**'
-                detail_lines.append(line)
+                parts.append(f'\n- {status_icon} **{result["name"]}**')
                 if result['detail']:
-                    detail_lines.append(f'  - {result["detail"]}')
-            sections.append('\n'.join(detail_lines))
+                    parts.append(f'\n  - {result["detail"]}')
 
-        summary_lines = [
-            '### 签到统计',
-            f'- ✅ 成功：**{success_count}/{total_count}**',
-            f'- ❌ 失败：**{total_count - success_count}/{total_count}**',
-        ]
+        parts.extend((
+            '\n\n### 签到统计',
+            f'\n- ✅ 成功：**{success_count}/{total_count}**',
+            f'\n- ❌ 失败：**{total_count - success_count}/{total_count}**',
+        ))
 
         if success_count == total_count:
-            summary_lines.append('- 🎉 所有账号签到成功！')
+            parts.append('\n- 🎉 所有账号签到成功！')
         elif success_count > 0:
-            summary_lines.append('- ⚠️ 部分账号签到成功，请关注失败账号')
+            parts.append('\n- ⚠️ 部分账号签到成功，请关注失败账号')
         else:
-            summary_lines.append('- ❌ 所有账号签到失败，请及时处理')
-
-        sections.append('\n'.join(summary_lines))
+            parts.append('\n- ❌ 所有账号签到失败，请及时处理')
 
-        notify_content = '\n\n'.join(sections)
+        notify_content = ''.join(parts)
 
         print(notify_content)
         notify.push_message('AnyRouter Check-in Alert', notify_content)
@@ -450,8 +710,17 @@ async def main():
 
 def run_main():
     """运行主函数的包装函数"""
+    # 可用时使用 uvloop 作为事件循环（Windows 不支持），否则使用默认事件循环
+    try:
+        import uvloop
+
+        loop_factory = uvloop.new_event_loop
+    except ImportError:
+        loop_factory = None
+
     try:
-        asyncio.run(main())
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(main())
     except KeyboardInterrupt:
         print('\n[WARNING] Program interrupted by user')
         sys.exit(1)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+# 添加项目根目录到 PATH
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+
+import checkin
+from checkin import (
+	_AccountLog,
+	_try_fetch_waf_cookies_http,
+	calc_acw_sc_v2,
+	load_accounts,
+	parse_cookies,
+	save_waf_cookies_cache,
+)
+
+CHALLENGE_HTML = "<html><script>var arg1='0123456789ABCDEF0123456789ABCDEF01234567';</script></html>"
+
+
+def test_calc_acw_sc_v2():
+	# 期望值由 WAF 挑战页中的原始 JS 算法计算得到
+	assert calc_acw_sc_v2('0123456789ABCDEF0123456789ABCDEF01234567') == 'd2c7186598ab1a508a4f6064e4fa746323ab17c6'
+	assert calc_acw_sc_v2('5F2B1C8E9A7D3E4F6A0B1C2D3E4F5A6B7C8D9E0F') == '785d683ea98394c435d20bedd1bd938b46afcaa8'
+
+
+def test_calc_acw_sc_v2_zero_arg1_returns_mask():
+	assert calc_acw_sc_v2('0' * 40) == '3000176000856006061501533003690027800375'
+
+
+@patch('checkin.httpx.AsyncClient')
+def test_fetch_waf_cookies_http_repeated_challenge(mock_client_cls):
+	client = MagicMock()
+	client.get = AsyncMock(return_value=MagicMock(text=CHALLENGE_HTML))
+	mock_client_cls.return_value.__aenter__.return_value = client
+
+	log = _AccountLog('测试账号')
+	assert asyncio.run(_try_fetch_waf_cookies_http(log)) == (None, None)
+
+	assert client.get.await_count == 2
+	client.cookies.set.assert_called_once_with(
+		'acw_sc__v2', 'd2c7186598ab1a508a4f6064e4fa746323ab17c6', domain='anyrouter.top'
+	)
+
+
+def _patch_async_client(monkeypatch, handler):
+	real_client = httpx.AsyncClient
+	transport = httpx.MockTransport(handler)
+	monkeypatch.setattr(checkin.httpx, 'AsyncClient', lambda **kwargs: real_client(transport=transport, **kwargs))
+
+
+def test_fetch_waf_cookies_http_solves_challenge(monkeypatch):
+	requests = []
+
+	def handler(request):
+		requests.append(request)
+		if len(requests) == 1:
+			return httpx.Response(
+				200,
+				html=CHALLENGE_HTML,
+				headers={'Set-Cookie': 'acw_tc=tc; Domain=anyrouter.top; Path=/; Expires=Wed, 01 Jan 2098 00:00:00 GMT'},
+			)
+		return httpx.Response(
+			200,
+			html='<html>login</html>',
+			headers={'Set-Cookie': 'cdn_sec_tc=sec; Domain=anyrouter.top; Path=/; Expires=Tue, 01 Jan 2097 00:00:00 GMT'},
+		)
+
+	_patch_async_client(monkeypatch, handler)
+
+	waf_cookies, expires = asyncio.run(_try_fetch_waf_cookies_http(_AccountLog('测试账号')))
+
+	assert waf_cookies == {
+		'acw_tc': 'tc',
+		'cdn_sec_tc': 'sec',
+		'acw_sc__v2': 'd2c7186598ab1a508a4f6064e4fa746323ab17c6',
+	}
+	# 取最早过期的 cookie 时间
+	assert expires == 4007836800
+	assert 'acw_sc__v2=d2c7186598ab1a508a4f6064e4fa746323ab17c6' in requests[1].headers['cookie']
+
+
+def test_fetch_waf_cookies_http_without_challenge(monkeypatch):
+	def handler(request):
+		return httpx.Response(200, html='<html>login</html>', headers={'Set-Cookie': 'acw_tc=tc; Path=/'})
+
+	_patch_async_client(monkeypatch, handler)
+
+	assert asyncio.run(_try_fetch_waf_cookies_http(_AccountLog('测试账号'))) == ({'acw_tc': 'tc'}, None)
+
+
+def test_fetch_waf_cookies_http_without_acw_tc(monkeypatch):
+	_patch_async_client(monkeypatch, lambda request: httpx.Response(200, html='<html>login</html>'))
+
+	assert asyncio.run(_try_fetch_waf_cookies_http(_AccountLog('测试账号'))) == (None, None)
+
+
+def test_parse_cookies_string():
+	assert parse_cookies('session=abc; api_user=123') == {'session': 'abc', 'api_user': '123'}
+
+
+def test_parse_cookies_value_with_equals():
+	assert parse_cookies('session=a=b==; other=1') == {'session': 'a=b==', 'other': '1'}
+
+
+def test_parse_cookies_empty_value():
+	assert parse_cookies('session=; other=1') == {'session': '', 'other': '1'}
+
+
+def test_parse_cookies_skips_tokens_without_equals():
+	assert parse_cookies('flag; session=abc; ;') == {'session': 'abc'}
+
+
+def test_parse_cookies_strips_surrounding_whitespace():
+	assert parse_cookies('  session=abc  ;\tother=1 ') == {'session': 'abc', 'other': '1'}
+	# 与按分号切分后 strip 的行为一致：键名内部及等号两侧的空白会保留
+	assert parse_cookies('x y=1; z = 2') == {'x y': '1', 'z ': ' 2'}
+	assert parse_cookies('=v') == {'': 'v'}
+
+
+def test_parse_cookies_dict_and_invalid():
+	cookies = {'session': 'abc'}
+	assert parse_cookies(cookies) is cookies
+	assert parse_cookies(None) == {}
+
+
+def test_save_waf_cookies_cache_warning_goes_to_account_log(tmp_path, monkeypatch):
+	monkeypatch.setattr(checkin, 'WAF_CACHE_FILE', str(tmp_path / 'missing' / 'waf_cache.json'))
+
+	log = _AccountLog('测试账号')
+	save_waf_cookies_cache({'acw_tc': 'a'}, None, log)
+
+	assert len(log.buf) == 1
+	assert log.buf[0].startswith('Warning: 测试账号: Failed to save WAF cookies cache')
+
+
+def test_load_accounts_does_not_cache_failures(monkeypatch):
+	monkeypatch.delenv('ANYROUTER_ACCOUNTS', raising=False)
+	assert load_accounts() is None
+
+	monkeypatch.setenv('ANYROUTER_ACCOUNTS', '{"cookies": {}}')
+	assert load_accounts() is None
+
+	monkeypatch.setenv('ANYROUTER_ACCOUNTS', '[{"cookies": {"session": "abc"}, "api_user": "1"}]')
+	assert load_accounts() == [{'cookies': {'session': 'abc'}, 'api_user': '1'}]
+
+
+def test_load_accounts_returns_fresh_list(monkeypatch):
+	monkeypatch.setenv('ANYROUTER_ACCOUNTS', '[{"cookies": {"session": "abc"}, "api_user": "1"}]')
+
+	accounts = load_accounts()
+	accounts[0]['name'] = 'changed'
+	accounts.append({})
+
+	assert load_accounts() == [{'cookies': {'session': 'abc'}, 'api_user': '1'}]
+
+
+def _run_main(monkeypatch, tmp_path, sign_in_responses, waf_fetches):
+	"""以 mock 的网络请求运行 main()，返回 (退出码, get_waf_cookies 每次调用的 use_cache 参数)"""
+	accounts = [{'name': name, 'cookies': {'session': name}, 'api_user': name} for name in sign_in_responses]
+	monkeypatch.setenv('ANYROUTER_ACCOUNTS', json.dumps(accounts))
+	monkeypatch.setenv('ANYROUTER_CONCURRENCY', '1')
+	monkeypatch.setattr(checkin, 'BALANCE_HASH_FILE', str(tmp_path / 'balance_hash.txt'))
+	monkeypatch.setattr(checkin.notify, 'push_message', MagicMock())
+
+	fetches = iter(waf_fetches)
+	waf_calls = []
+
+	async def fake_get_waf_cookies(get_browser, log, use_cache=True):
+		waf_calls.append(use_cache)
+		return next(fetches)
+
+	async def fake_get_user_info(session, headers, cookies):
+		return {'success': True, 'quota': 1.0, 'used_quota': 0.0, 'display': 'balance'}
+
+	async def fake_sign_in(session, headers, cookies):
+		return sign_in_responses[headers['new-api-user']](cookies['acw_tc'])
+
+	monkeypatch.setattr(checkin, 'get_waf_cookies', fake_get_waf_cookies)
+	monkeypatch.setattr(checkin, 'get_user_info', fake_get_user_info)
+	monkeypatch.setattr(checkin, 'sign_in', fake_sign_in)
+
+	with pytest.raises(SystemExit) as exc_info:
+		asyncio.run(checkin.main())
+	return exc_info.value.code, waf_calls
+
+
+def _ok(acw_tc):
+	return 200, '{"success": true}'
+
+
+def test_json_403_is_not_treated_as_waf_rejection(monkeypatch, tmp_path, capsys):
+	responses = {
+		'A': lambda acw_tc: (403, '{"success": false, "message": "user disabled"}'),
+		'B': _ok,
+	}
+	code, waf_calls = _run_main(monkeypatch, tmp_path, responses, [{'acw_tc': 'old'}])
+	output = capsys.readouterr().out
+
+	assert code == 0
+	assert waf_calls == [True]
+	assert '[FAILED] A: Check-in failed - HTTP 403' in output
+	assert '[SUCCESS] B: Check-in successful!' in output
+	assert 'WAF rejected' not in output
+
+
+def test_waf_challenge_refreshes_cookies_once_and_retries(monkeypatch, tmp_path, capsys):
+	def respond(acw_tc):
+		return (200, CHALLENGE_HTML) if acw_tc == 'old' else (200, '{"success": true}')
+
+	code, waf_calls = _run_main(
+		monkeypatch, tmp_path, {'A': respond, 'B': respond}, [{'acw_tc': 'old'}, {'acw_tc': 'new'}]
+	)
+	output = capsys.readouterr().out
+
+	assert code == 0
+	# 只在第一个账号被拦截时重新获取一次，后续账号直接使用新的 cookies
+	assert waf_calls == [True, False]
+	assert '[SUCCESS] A: Check-in successful!' in output
+	assert '[SUCCESS] B: Check-in successful!' in output
+
+
+def test_failed_waf_refresh_keeps_previous_cookies(monkeypatch, tmp_path, capsys):
+	responses = {
+		'A': lambda acw_tc: (403, '<html>Forbidden</html>'),
+		'B': lambda acw_tc: (200, '{"success": true}') if acw_tc == 'old' else (500, ''),
+	}
+	code, waf_calls = _run_main(monkeypatch, tmp_path, responses, [{'acw_tc': 'old'}, None])
+	output = capsys.readouterr().out
+
+	assert code == 0
+	assert waf_calls == [True, False]
+	assert '[FAILED] A processing exception: WAF rejected request with HTTP 403' in output
+	assert '[SUCCESS] B: Check-in successful!' in output